@@ -34,22 +34,32 @@ from __future__ import annotations  # workaround for PYTHON <= 3.10
 
 import argparse
 import base64
+import binascii
+import codecs
+import contextlib
 import csv
-import fileinput
+import functools
 import glob
+import importlib.util
+import io
 import json
 import os
 import platform
+import queue
 import re
 import sys
-import urllib.parse as urlparse
+import threading
+import time
 from enum import Enum, IntEnum
 from importlib.metadata import PackageNotFoundError, version
-from typing import (Any, Final, List, Optional, Sequence, TextIO, Tuple,
-                    TypedDict, Union)
+from urllib.parse import parse_qs, quote, quote_plus, unquote_plus, urlparse
+from typing import (Any, ContextManager, Final, Iterator,
+                    List, Optional, Sequence, Set, TextIO, Tuple, TypedDict,
+                    Union)
 
 import colorama
-from qrcode import QRCode  # type: ignore
+from google.protobuf import __version__ as protobuf_version
+from google.protobuf.internal import api_implementation
 
 import protobuf_generated_python.google_auth_pb2 as pb
 
@@ -57,6 +67,17 @@ debug_mode = '-d' in sys.argv[1:] or '--debug' in sys.argv[1:]
 quiet = '-q' in sys.argv[1:] or '--quiet' in sys.argv[1:]
 headless: bool = False
 
+try:
+    import pybase64  # type: ignore
+    pybase64_available = True
+except ImportError:
+    pybase64_available = False
+
+try:
+    import orjson  # type: ignore
+    orjson_available = True
+except ImportError:
+    orjson_available = False
 
 try:
     import cv2
@@ -72,7 +93,9 @@ try:
 
     try:
         import pyzbar.pyzbar as zbar  # type: ignore
-        from qreader import QReader  # type: ignore
+        # QReader is imported on demand, since the import of its neural network is slow
+        if importlib.util.find_spec('qreader') is None:
+            raise ImportError("No module named 'qreader'")
         zbar_available = True
     except Exception as e:
         if not quiet:
@@ -111,6 +134,12 @@ Exception: {e}\n""", file=sys.stderr)
     CHAR_DX: Final[int] = (lambda text: cv2.getTextSize(text, FONT, FONT_SCALE, FONT_THICKNESS)[0][TEXT_WIDTH] // len(text))("28 QR codes capturedMMM")
     FONT_DY: Final[int] = cv2.getTextSize("M", FONT, FONT_SCALE, FONT_THICKNESS)[0][TEXT_HEIGHT] + 5
     WINDOW_NAME: Final[str] = "Extract OTP Secrets: Capture QR Codes from Camera"
+    FRAME_DIFF_SIZE: Final[Point] = 32, 32
+    # QReader detects the QR code on a downscaled frame, the decoding is done on the full resolution frame
+    QREADER_DETECT_SCALE: Final[int] = 2
+    # mean absolute difference per pixel of the downsampled frames below which a frame is considered unchanged
+    FRAME_DIFF_THRESHOLD: Final[float] = 2.0 * FRAME_DIFF_SIZE[0] * FRAME_DIFF_SIZE[1]
+    FRAME_DIFF_MAX_AGE: Final[float] = 0.5  # seconds
 
     TextPosition = Enum('TextPosition', ['LEFT', 'RIGHT'])
 
@@ -139,6 +168,10 @@ LogLevel = IntEnum('LogLevel', ['QUIET', 'NORMAL', 'VERBOSE', 'MORE_VERBOSE', 'D
 # Constants
 CAMERA: Final[str] = 'camera'
 CV2_QRMODES: List[str] = [QRMode.CV2.name, QRMode.CV2_WECHAT.name]
+FILE_BUFFER_SIZE: Final[int] = 1 << 20
+KEEPASS_TOTP_HEADER: Final[Tuple[str, ...]] = ("Title", "User Name", "TimeOtp-Secret-Base32", "Group")
+KEEPASS_HOTP_HEADER: Final[Tuple[str, ...]] = ("Title", "User Name", "HmacOtp-Secret-Base32", "HmacOtp-Counter", "Group")
+FILE_NAME_INVALID_CHARS: Final[re.Pattern[str]] = re.compile(r'[\W_]+')
 
 # Global variable declaration
 verbose: IntEnum = LogLevel.NORMAL
@@ -146,6 +179,8 @@ colored: bool = True
 executable: bool = False
 __version__: str
 tk_root: tkinter.Tk
+# reused for all otp urls, ParseFromString() clears the message
+migration_payload: pb.MigrationPayload = pb.MigrationPayload()
 
 
 def sys_main() -> None:
@@ -154,8 +189,6 @@ def sys_main() -> None:
 
 def main(sys_args: list[str]) -> None:
     global executable, tk_root, headless
-    # allow to use sys.stdout with with (avoid closing)
-    sys.stdout.close = lambda: None  # type: ignore
     # set encoding to utf-8, needed for Windows
     try:
         sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
@@ -194,65 +227,95 @@ def main(sys_args: list[str]) -> None:
 
 # workaround for PYTHON <= 3.9 use: pb.MigrationPayload | None
 def get_payload_from_otp_url(otp_url: str, i: int, source: str) -> Optional[pb.MigrationPayload]:
-    '''Extracts the otp migration payload from an otp url. This function is the core of the this appliation.'''
+    '''Extracts the otp migration payload from an otp url. This function is the core of the this appliation.
+    Note: The returned payload is overwritten by the next call.'''
     if not is_opt_url(otp_url, source):
         return None
-    parsed_url = urlparse.urlparse(otp_url)
-    if verbose >= LogLevel.DEBUG: log_debug(f"parsed_url={parsed_url}")
-    try:
-        params = urlparse.parse_qs(parsed_url.query, strict_parsing=True)
-    except Exception:  # workaround for PYTHON <= 3.10
-        params = {}
-    if verbose >= LogLevel.DEBUG: log_debug(f"querystring params={params}")
-    if 'data' not in params:
+    if verbose >= LogLevel.DEBUG: log_debug_otp_url_params(otp_url)
+    data_base64 = get_data_base64_from_otp_url(otp_url)
+    if not data_base64:
         log_error(f"could not parse query parameter in input url\nsource: {source}\nurl: {otp_url}")
         return None
-    data_base64 = params['data'][0]
     if verbose >= LogLevel.DEBUG: log_debug(f"data_base64={data_base64}")
     data_base64_fixed = data_base64.replace(' ', '+')
     if verbose >= LogLevel.DEBUG: log_debug(f"data_base64_fixed={data_base64_fixed}")
-    data = base64.b64decode(data_base64_fixed, validate=True)
-    payload = pb.MigrationPayload()
+    data = decode_base64(data_base64_fixed)
     try:
-        payload.ParseFromString(data)
+        migration_payload.ParseFromString(data)
     except Exception as e:
         abort(f"Cannot decode otpauth-migration migration payload.\n"
               f"data={data_base64}", e)
-    if verbose >= LogLevel.DEBUG: log_debug(f"\n{i}. Payload Line", payload, sep='\n')
-
-    return payload
+    if verbose >= LogLevel.DEBUG: log_debug(f"\n{i}. Payload Line", migration_payload, sep='\n')
 
+    return migration_payload
 
-def extract_otp_from_otp_url(otpauth_migration_url: str, otps: Otps, urls_count: int, infile: str, args: Args) -> int:
-    '''Converts the otp migration payload into a normal Python dictionary. This function is the core of the this appliation.'''
-    payload = get_payload_from_otp_url(otpauth_migration_url, urls_count, infile)
 
-    if not payload:
-        return 0
+def log_debug_otp_url_params(otp_url: str) -> None:
+    '''Parses all parameters of the otp url, this is only done for the debug output.'''
+    parsed_url = urlparse(otp_url)
+    log_debug(f"parsed_url={parsed_url}")
+    try:
+        params = parse_qs(parsed_url.query, strict_parsing=True)
+    except Exception:  # workaround for PYTHON <= 3.10
+        params = {}
+    log_debug(f"querystring params={params}")
+
+
+def convert_raw_otp(raw_otp: pb.MigrationPayload.OtpParameters) -> Otp:
+    # read each protobuf field only once
+    name, issuer, otp_type_code = raw_otp.name, raw_otp.issuer, raw_otp.type
+    secret = convert_secret_from_bytes_to_base32_str(raw_otp.secret)
+    otp_type = get_otp_type_str_from_code(otp_type_code)
+    counter = raw_otp.counter if otp_type_code == 1 else None
+    return {
+        "name": name,
+        "secret": secret,
+        "issuer": issuer,
+        "type": otp_type,
+        "counter": counter,
+        "url": build_otp_url(otp_type, name, secret, issuer, counter)
+    }
+
+
+def get_data_base64_from_otp_url(otp_url: str) -> str:
+    # Only the data parameter is relevant, thus the query is parsed directly instead of using urlparse and parse_qs
+    query = otp_url.partition('?')[2].partition('#')[0]
+    return next((unquote_plus(param[len('data='):]) for param in query.split('&') if param.startswith('data=')), '')
+
+
+def extract_otp_from_otp_url(otpauth_migration_url: str, otps: Otps, otp_keys: Set[Tuple[Any, ...]], otps_by_otp_url: dict[str, Otps], urls_count: int, infile: str, args: Args) -> int:
+    '''Converts the otp migration payload into a normal Python dictionary. This function is the core of the this appliation.
+    otp_keys are the keys of the otps for the duplicate check of --ignore in O(1).
+    otps_by_otp_url caches the decoded otps, thus duplicate otp urls, e.g. in several files, are decoded only once per run.'''
+    # the debug output shows the payload of each otp url, thus the cache is not used in debug mode
+    url_otps = otps_by_otp_url.get(otpauth_migration_url) if verbose < LogLevel.DEBUG else None
+    payload = None
+    if url_otps is None:
+        payload = get_payload_from_otp_url(otpauth_migration_url, urls_count, infile)
+
+        if not payload:
+            return 0
+
+        # pylint: disable=no-member
+        url_otps = otps_by_otp_url[otpauth_migration_url] = [convert_raw_otp(raw_otp) for raw_otp in payload.otp_parameters]
 
     new_otps_count = 0
-    # pylint: disable=no-member
-    for raw_otp in payload.otp_parameters:
+    for i, url_otp in enumerate(url_otps):
         if verbose: print(f"\n{len(otps) + 1}. Secret")
-        secret = convert_secret_from_bytes_to_base32_str(raw_otp.secret)
-        if verbose >= LogLevel.DEBUG: log_debug('OTP enum type:', get_enum_name_by_number(raw_otp, 'type'))
-        otp_type = get_otp_type_str_from_code(raw_otp.type)
-        otp_url = build_otp_url(secret, raw_otp)
-        otp: Otp = {
-            "name": raw_otp.name,
-            "secret": secret,
-            "issuer": raw_otp.issuer,
-            "type": otp_type,
-            "counter": raw_otp.counter if raw_otp.type == 1 else None,
-            "url": otp_url
-        }
-        if otp not in otps or not args.ignore:
+        # in debug mode the payload is always decoded, since the cache is not used
+        if verbose >= LogLevel.DEBUG and payload: log_debug('OTP enum type:', get_enum_name_by_number(payload.otp_parameters[i], 'type'))
+        # copy, since the cached otp may be appended more than once
+        otp = url_otp.copy()
+        # the keys are only needed for the duplicate check of --ignore
+        otp_key = tuple(otp.values()) if args.ignore else None
+        if otp_key is None or otp_key not in otp_keys:
+            if otp_key is not None: otp_keys.add(otp_key)
             otps.append(otp)
             new_otps_count += 1
             if not quiet:
                 print_otp(otp)
             if args.printqr:
-                print_qr(otp_url)
+                print_qr(otp['url'])
             if args.saveqr:
                 save_qr_image(otp, args.saveqr, len(otps))
             if not quiet:
@@ -305,18 +368,21 @@ b) image file containing a QR code or = for stdin for an image containing a QR c
     args = arg_parser.parse_args(sys_args)
     colored = not args.no_color
     if args.csv == '-' or args.json == '-' or args.keepass == '-' or args.txt == '-' or args.urls == '-':
-        args.quiet = args.q = True
+        args.quiet = True
 
     verbose = args.verbose if args.verbose else LogLevel.NORMAL
     if args.debug:
         verbose = LogLevel.DEBUG
         log_debug('Debug mode start')
         log_debug(args)
-    quiet = True if args.quiet else False
+    quiet = args.quiet
     if verbose: print(f"QReader installed: {cv2_available}")
+    if verbose >= LogLevel.VERBOSE: print(f"Protobuf version: {protobuf_version} ({api_implementation.Type()})")
     if cv2_available:
         if verbose >= LogLevel.VERBOSE: print(f"CV2 version: {cv2.__version__}")
         if verbose: print(f"QR reading mode: {args.qr}\n")
+    if verbose and not has_native_protobuf():
+        log_warn("The pure Python protobuf implementation is used, decoding is slow. Install a protobuf wheel with the upb or cpp backend.")
 
     return args
 
@@ -330,76 +396,128 @@ def extract_otps(args: Args) -> Otps:
 
 def extract_otps_from_camera(args: Args) -> Otps:
     if verbose: print("Capture QR codes from camera")
-    otp_urls: OtpUrls = []
+    otp_urls: Set[OtpUrl] = set()
     otps: Otps = []
 
     qr_mode = QRMode[args.qr]
 
     cam = cv2.VideoCapture(args.camera)
     cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_AUTOSIZE)
-
-    if zbar_available:
-        qreader = QReader()
-    cv2_qr = cv2.QRCodeDetector()
-    cv2_qr_wechat = cv2.wechat_qrcode.WeChatQRCode()
+    # the text widths are cached per camera session
+    cv2_get_text_width.cache_clear()
+
+    last_frame: Optional[cv2.typing.MatLike] = None
+    last_detection_time = 0.0
+    boxes: List[Tuple[Any, ColorBGR]] = []
+    # the frames are captured in a background thread, so that the capturing overlaps with the QR detection
+    frames: queue.Queue[Tuple[bool, Any]] = queue.Queue(maxsize=1)
+    stop_capture = threading.Event()
+    capture_thread = threading.Thread(target=cv2_capture_frames, args=(cam, frames, stop_capture), daemon=True)
+    capture_thread.start()
     while True:
-        success, img = cam.read()
+        success, img = frames.get()
         new_otps_count = 0
         if not success:
             log_error("Failed to capture image from camera")
             break
-        try:
-            if qr_mode in [QRMode.QREADER, QRMode.QREADER_DEEP]:
-                found, bbox = qreader.detect(img)
-                if qr_mode == QRMode.QREADER_DEEP:
-                    otp_url = qreader.detect_and_decode(img, True)
-                elif qr_mode == QRMode.QREADER:
-                    otp_url = qreader.decode(img, bbox) if found else None
-                if otp_url:
-                    new_otps_count = extract_otps_from_otp_url(otp_url, otp_urls, otps, args)
-                if found:
-                    cv2_draw_box(img, [(bbox[0], bbox[1]), (bbox[2], bbox[1]), (bbox[2], bbox[3]), (bbox[0], bbox[3])], get_color(new_otps_count, otp_url))
-            elif qr_mode == QRMode.ZBAR:
-                for qrcode in zbar.decode(img, symbols=[zbar.ZBarSymbol.QRCODE]):
-                    otp_url = qrcode.data.decode('utf-8')
-                    new_otps_count = extract_otps_from_otp_url(otp_url, otp_urls, otps, args)
-                    cv2_draw_box(img, [qrcode.polygon], get_color(new_otps_count, otp_url))
-            elif qr_mode in [QRMode.CV2, QRMode.CV2_WECHAT]:
-                if QRMode.CV2:
-                    otp_url, raw_pts, _ = cv2_qr.detectAndDecode(img)
-                else:
-                    otp_url, raw_pts = cv2_qr_wechat.detectAndDecode(img)
-                if raw_pts is not None:
+        frame = cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), FRAME_DIFF_SIZE, interpolation=cv2.INTER_AREA)
+        # skip the expensive QR detection on unchanged frames and reuse the boxes of the last detection
+        now = time.monotonic()
+        if is_detection_needed(frame, last_frame, now - last_detection_time):
+            last_frame, last_detection_time = frame, now
+            boxes = []
+            try:
+                if qr_mode in [QRMode.QREADER, QRMode.QREADER_DEEP]:
+                    otp_url, bbox = qreader_detect_and_decode(img, qr_mode == QRMode.QREADER_DEEP)
                     if otp_url:
                         new_otps_count = extract_otps_from_otp_url(otp_url, otp_urls, otps, args)
-                    cv2_draw_box(img, raw_pts, get_color(new_otps_count, otp_url))
-            else:
-                abort(f"Invalid QReader mode: {qr_mode.name}")
-        except Exception as e:
-            log_error(f'An error occured during QR detection and decoding for QR reader {qr_mode}. Changed to the next QR reader.', e)
-            qr_mode = next_qr_mode(qr_mode)
-            continue
-
-        cv2_print_text(img, f"Mode: {qr_mode.name} (Hit SPACE to change)", 0, TextPosition.LEFT, FONT_COLOR, 20)
-        cv2_print_text(img, "Press ESC to quit", 1, TextPosition.LEFT, FONT_COLOR, 17)
-        cv2_print_text(img, "Press c,j,k,t,u to save as csv/json/keepass/txt/urls file", 2, TextPosition.LEFT, FONT_COLOR, None)
-
-        cv2_print_text(img, f"{len(otp_urls)} QR code{'s'[:len(otp_urls) != 1]} captured", 0, TextPosition.RIGHT, FONT_COLOR)
-        cv2_print_text(img, f"{len(otps)} otp{'s'[:len(otps) != 1]} extracted", 1, TextPosition.RIGHT, FONT_COLOR)
+                    if bbox:
+                        boxes.append(([(bbox[0], bbox[1]), (bbox[2], bbox[1]), (bbox[2], bbox[3]), (bbox[0], bbox[3])], get_color(new_otps_count, otp_url)))
+                elif qr_mode == QRMode.ZBAR:
+                    for qrcode in zbar.decode(img, symbols=[zbar.ZBarSymbol.QRCODE]):
+                        otp_url = qrcode.data.decode('utf-8')
+                        new_otps_count = extract_otps_from_otp_url(otp_url, otp_urls, otps, args)
+                        boxes.append((qrcode.polygon, get_color(new_otps_count, otp_url)))
+                elif qr_mode == QRMode.CV2:
+                    otp_url, raw_pts, _ = get_cv2_qr_detector().detectAndDecode(img)
+                    if raw_pts is not None:
+                        if otp_url:
+                            new_otps_count = extract_otps_from_otp_url(otp_url, otp_urls, otps, args)
+                        boxes.append((raw_pts, get_color(new_otps_count, otp_url)))
+                elif qr_mode == QRMode.CV2_WECHAT:
+                    # the WeChat detector returns all QR codes of the frame
+                    for otp_url, raw_pts in zip(*get_cv2_wechat_qr_detector().detectAndDecode(img)):
+                        new_otps_count = extract_otps_from_otp_url(otp_url, otp_urls, otps, args)
+                        boxes.append((raw_pts, get_color(new_otps_count, otp_url)))
+                else:
+                    abort(f"Invalid QReader mode: {qr_mode.name}")
+            except Exception as e:
+                log_error(f'An error occured during QR detection and decoding for QR reader {qr_mode}. Changed to the next QR reader.', e)
+                qr_mode = next_qr_mode(qr_mode)
+                last_frame = None
+                continue
+        for raw_pts, color in boxes:
+            cv2_draw_box(img, raw_pts, color)
+
+        # the window size is queried once per frame for all texts
+        window_width = cv2.getWindowImageRect(WINDOW_NAME)[WINDOW_WIDTH]
+        cv2_print_text(img, f"Mode: {qr_mode.name} (Hit SPACE to change)", 0, TextPosition.LEFT, FONT_COLOR, window_width, 20)
+        cv2_print_text(img, "Press ESC to quit", 1, TextPosition.LEFT, FONT_COLOR, window_width, 17)
+        cv2_print_text(img, "Press c,j,k,t,u to save as csv/json/keepass/txt/urls file", 2, TextPosition.LEFT, FONT_COLOR, window_width, None)
+
+        otp_urls_count, otps_count = len(otp_urls), len(otps)
+        cv2_print_text(img, f"{otp_urls_count} QR code{plural_s(otp_urls_count)} captured", 0, TextPosition.RIGHT, FONT_COLOR, window_width)
+        cv2_print_text(img, f"{otps_count} otp{plural_s(otps_count)} extracted", 1, TextPosition.RIGHT, FONT_COLOR, window_width)
 
         cv2.imshow(WINDOW_NAME, img)
 
-        quit, qr_mode = cv2_handle_pressed_keys(qr_mode, otps)
+        quit, new_qr_mode = cv2_handle_pressed_keys(qr_mode, otps)
         if quit:
             break
+        if new_qr_mode != qr_mode:
+            qr_mode, last_frame = new_qr_mode, None
 
+    stop_capture.set()
+    capture_thread.join()
     cam.release()
     cv2.destroyAllWindows()
 
     return otps
 
 
-def get_color(new_otps_count: int, otp_url: str) -> ColorBGR:
+# workaround for PYTHON <= 3.9 use: Tuple[str | None, Tuple[int, int, int, int] | None]
+def qreader_detect_and_decode(img: cv2.typing.MatLike, deep_search: bool) -> Tuple[Optional[str], Optional[Tuple[int, int, int, int]]]:
+    '''Returns the otp url and the bounding box (x1, y1, x2, y2) of the QR code.
+    The bounding box is detected on the downscaled frame, also for the deep search, which does not return its bounding box.'''
+    qreader = get_qreader()
+    small_img = cv2.resize(img, None, fx=1 / QREADER_DETECT_SCALE, fy=1 / QREADER_DETECT_SCALE, interpolation=cv2.INTER_AREA)
+    found, small_bbox = qreader.detect(small_img)
+    bbox = None
+    if found:
+        # the scale is calculated from the actual sizes, since the sizes of odd frames are rounded by the resizing
+        height, width = img.shape[:2]
+        scale_x, scale_y = width / small_img.shape[1], height / small_img.shape[0]
+        x1, y1, x2, y2 = small_bbox
+        bbox = int(x1 * scale_x), int(y1 * scale_y), min(round(x2 * scale_x), width), min(round(y2 * scale_y), height)
+    if deep_search:
+        return qreader.detect_and_decode(img, True), bbox
+    return qreader.decode(img, bbox) if bbox else None, bbox
+
+
+# workaround for PYTHON <= 3.9 use: cv2.typing.MatLike | None
+def is_detection_needed(frame: cv2.typing.MatLike, last_frame: Optional[cv2.typing.MatLike], detection_age: float) -> bool:
+    '''An unchanged frame is detected again after some time, e.g. if the detection failed on a blurred frame.'''
+    return detection_age >= FRAME_DIFF_MAX_AGE or is_frame_changed(frame, last_frame)
+
+
+# workaround for PYTHON <= 3.9 use: cv2.typing.MatLike | None
+def is_frame_changed(frame: cv2.typing.MatLike, last_frame: Optional[cv2.typing.MatLike]) -> bool:
+    '''Compares the downscaled grayscale frames, which is much cheaper than the QR detection.'''
+    return last_frame is None or cv2.norm(frame, last_frame, cv2.NORM_L1) >= FRAME_DIFF_THRESHOLD
+
+
+# workaround for PYTHON <= 3.9 use: str | None
+def get_color(new_otps_count: int, otp_url: Optional[str]) -> ColorBGR:
     if new_otps_count:
         return SUCCESS_COLOR
     else:
@@ -409,31 +527,51 @@ def get_color(new_otps_count: int, otp_url: str) -> ColorBGR:
             return NORMAL_COLOR
 
 
+def cv2_capture_frames(cam: cv2.VideoCapture, frames: queue.Queue[Tuple[bool, Any]], stop_capture: threading.Event) -> None:
+    '''Reads the camera frames until stop_capture is set. Only the newest frame is kept in frames.'''
+    success = True
+    while success and not stop_capture.is_set():
+        try:
+            success, img = cam.read()
+        except Exception as e:
+            log_error("Could not read frame from camera", e)
+            success, img = False, None
+        try:
+            # drop the stale frame, which was not detected yet
+            frames.get_nowait()
+        except queue.Empty:
+            pass
+        frames.put((success, img))
+
+
 # TODO use proper cv2 types if available
 def cv2_draw_box(img: cv2.typing.MatLike, raw_pts: cv2.typing.MatLike | list[tuple[Any, Any]], color: ColorBGR) -> np.ndarray[Any, np.dtype[np.int32]]:
-    pts = np.array([raw_pts], np.int32)
-    pts = pts.reshape((-1, 1, 2))
+    pts = np.asarray(raw_pts, np.int32).reshape((-1, 1, 2))
     cv2.polylines(img, [pts], True, color, BOX_THICKNESS)
     return pts
 
 
-def cv2_print_text(img: cv2.typing.MatLike, text: str, line_number: int, position: TextPosition, color: ColorBGR, opposite_len: Optional[int] = None) -> None:
-    window_dim = cv2.getWindowImageRect(WINDOW_NAME)
+def cv2_print_text(img: cv2.typing.MatLike, text: str, line_number: int, position: TextPosition, color: ColorBGR, window_width: int, opposite_len: Optional[int] = None) -> None:
     out_text = text
     if opposite_len:
-        text_dim, _ = cv2.getTextSize(out_text, FONT, FONT_SCALE, FONT_THICKNESS)
-        actual_width = text_dim[TEXT_WIDTH] + opposite_len * CHAR_DX + 4 * BORDER
-        if actual_width >= window_dim[WINDOW_WIDTH]:
-            out_text = out_text[:(window_dim[WINDOW_WIDTH] - actual_width) // CHAR_DX] + '.'
-    text_dim, _ = cv2.getTextSize(out_text, FONT, FONT_SCALE, FONT_THICKNESS)
+        actual_width = cv2_get_text_width(out_text) + opposite_len * CHAR_DX + 4 * BORDER
+        if actual_width >= window_width:
+            out_text = out_text[:(window_width - actual_width) // CHAR_DX] + '.'
     if position == TextPosition.LEFT:
         pos = BORDER, START_Y + line_number * FONT_DY
     else:
-        pos = window_dim[WINDOW_WIDTH] - text_dim[TEXT_WIDTH] - BORDER, START_Y + line_number * FONT_DY
+        pos = window_width - cv2_get_text_width(out_text) - BORDER, START_Y + line_number * FONT_DY
 
     cv2.putText(img, out_text, pos, FONT, FONT_SCALE, color, FONT_THICKNESS, FONT_LINE_STYLE)
 
 
+@functools.lru_cache(maxsize=64)
+def cv2_get_text_width(text: str) -> int:
+    '''The texts are the same for most frames, thus cache their width.'''
+    text_dim, _ = cv2.getTextSize(text, FONT, FONT_SCALE, FONT_THICKNESS)
+    return text_dim[TEXT_WIDTH]
+
+
 def cv2_handle_pressed_keys(qr_mode: QRMode, otps: Otps) -> Tuple[bool, QRMode]:
     key = cv2.waitKey(1) & 0xFF
     quit = False
@@ -509,22 +647,25 @@ def cv2_handle_pressed_keys(qr_mode: QRMode, otps: Otps) -> Tuple[bool, QRMode]:
     return quit, qr_mode
 
 
-def extract_otps_from_otp_url(otp_url: str, otp_urls: OtpUrls, otps: Otps, args: Args) -> int:
+def extract_otps_from_otp_url(otp_url: str, otp_urls: Set[OtpUrl], otps: Otps, args: Args) -> int:
     '''Returns -1 if opt_url was already added.'''
     if otp_url and verbose >= LogLevel.VERBOSE: print(otp_url)
     if not otp_url:
         return 0
     if otp_url not in otp_urls:
-        new_otps_count = extract_otp_from_otp_url(otp_url, otps, len(otp_urls), CAMERA, args)
+        # the camera extracts each otp url only once, thus no cache is needed
+        new_otps_count = extract_otp_from_otp_url(otp_url, otps, {tuple(otp.values()) for otp in otps} if args.ignore else set(), {}, len(otp_urls), CAMERA, args)
         if new_otps_count:
-            otp_urls.append(otp_url)
-        if verbose: print(f"Extracted {new_otps_count} otp{'s'[:len(otps) != 1]}. {len(otps)} otp{'s'[:len(otps) != 1]} from {len(otp_urls)} QR code{'s'[:len(otp_urls) != 1]} extracted")
+            otp_urls.add(otp_url)
+        if verbose: print(f"Extracted {new_otps_count} otp{plural_s(new_otps_count)}. {len(otps)} otp{plural_s(len(otps))} from {len(otp_urls)} QR code{plural_s(len(otp_urls))} extracted")
         return new_otps_count
     return -1
 
 
 def extract_otps_from_files(args: Args) -> Otps:
     otps: Otps = []
+    otp_keys: Set[Tuple[Any, ...]] = set()
+    otps_by_otp_url: dict[str, Otps] = {}
 
     files_count = urls_count = otps_count = 0
     if verbose: print(f"Input files: {args.infile}")
@@ -541,59 +682,69 @@ def extract_otps_from_files(args: Args) -> Otps:
                 if verbose >= LogLevel.MORE_VERBOSE: log_verbose(line)
                 if line.startswith('#') or line == '': continue
                 urls_count += 1
-                otps_count += extract_otp_from_otp_url(line, otps, urls_count, infile, args)
-    if verbose: print(f"Extracted {otps_count} otp{'s'[:otps_count != 1]} from {urls_count} otp url{'s'[:urls_count != 1]} by reading {files_count} infile{'s'[:files_count != 1]}")
+                otps_count += extract_otp_from_otp_url(line, otps, otp_keys, otps_by_otp_url, urls_count, infile, args)
+    if verbose: print(f"Extracted {otps_count} otp{plural_s(otps_count)} from {urls_count} otp url{plural_s(urls_count)} by reading {files_count} infile{plural_s(files_count)}")
     return otps
 
 
-def get_otp_urls_from_file(filename: str, args: Args) -> OtpUrls:
+def get_otp_urls_from_file(filename: str, args: Args) -> Iterator[OtpUrl]:
     # stdin stream cannot be rewinded, thus distinguish, use - for utf-8 stdin and = for binary image stdin
     if filename != '=':
         check_file_exists(filename)
-        lines = read_lines_from_text_file(filename)
-        if lines or filename == '-':
-            return lines
+        has_lines = False
+        try:
+            for line in read_lines_from_text_file(filename):
+                has_lines = True
+                yield line
+        except UnicodeDecodeError as e:
+            if filename == '-':
+                abort("Unable to open text file form stdin. "
+                      "In case you want read an image file from stdin, you must use '=' instead of '-'.", e)
+            # the lines before were already extracted, abort to prevent a partial export
+            abort(f"Unable to read text file {filename}, it is not utf-8 encoded", e)
+        if has_lines or filename == '-':
+            return
+        # The file is probably an image, process below
 
     # could not process text file, try reading as image
     if filename != '-' and cv2_available:
-        return convert_img_to_otp_urls(filename, args)
-
-    return []
+        yield from convert_img_to_otp_urls(filename, args)
 
 
-def read_lines_from_text_file(filename: str) -> list[str]:
+def read_lines_from_text_file(filename: str) -> Iterator[str]:
+    '''Yields the stripped lines. Yields no lines if the file starts with non utf-8 content, e.g. an image.
+    Raises UnicodeDecodeError if non utf-8 content follows later.'''
     if verbose >= LogLevel.DEBUG: print(f"Reading lines of {filename}")
-    # workaround for PYTHON <= 3.9 support encoding
-    if sys.version_info >= (3, 10):
-        finput = fileinput.input(filename, encoding='utf-8')
-    else:
-        finput = fileinput.input(filename)
-    try:
-        lines = []
-        for line in (line.strip() for line in finput):
-            if verbose >= LogLevel.DEBUG: log_verbose(line)
-            if is_binary(line):
-                abort("Binary input was given in stdin, please use = instead of - as infile argument for images.")
-            # unfortunately yield line leads to random test fails
-            lines.append(line)
-        if not lines:
-            log_warn(f"{filename.replace('-', 'stdin')} is empty")
-    except UnicodeDecodeError as e:
-        if filename == '-':
-            abort("Unable to open text file form stdin. "
-                  "In case you want read an image file from stdin, you must use '=' instead of '-'.", e)
-        else:  # The file is probably an image, process below
-            return []
-    finally:
-        finput.close()
-    return lines
+    if filename == '-':
+        yield from read_lines_from_text_stream(sys.stdin, filename)
+        return
+    # Read the file directly with buffered I/O instead of with fileinput, which processes each line in Python code.
+    # An mmap is not used, since it is not possible for stdin and empty files.
+    with io.BufferedReader(io.FileIO(filename), FILE_BUFFER_SIZE) as binary_file:
+        # The lines are yielded while reading, thus an image is detected by the first block in the buffer before the first line is yielded
+        if not is_utf8(binary_file.peek(FILE_BUFFER_SIZE)):
+            return
+        yield from read_lines_from_text_stream(io.TextIOWrapper(binary_file, encoding='utf-8'), filename)
+
+
+def read_lines_from_text_stream(infile: TextIO, filename: str) -> Iterator[str]:
+    is_empty = True
+    for line in (line.strip() for line in infile):
+        # the lines are logged by the processing of the otp urls, thus they are not logged here
+        if is_empty and is_binary(line):
+            abort("Binary input was given in stdin, please use = instead of - as infile argument for images.")
+        is_empty = False
+        yield line
+    if is_empty:
+        log_warn(f"{filename.replace('-', 'stdin')} is empty")
 
 
 def convert_img_to_otp_urls(filename: str, args: Args) -> OtpUrls:
     if verbose: print(f"Reading image {filename}")
     try:
         if filename != '=':
-            img = cv2.imread(filename)
+            # QR codes are black and white, the grayscale image reduces the memory traffic of the detectors
+            img = cv2.imread(filename, cv2.IMREAD_GRAYSCALE)
         else:
             try:
                 stdin = sys.stdin.buffer.read()
@@ -608,7 +759,7 @@ def convert_img_to_otp_urls(filename: str, args: Args) -> OtpUrls:
                 abort("Cannot read binary stdin buffer.", e)
             if not img_array.size:
                 return []
-            img = cv2.imdecode(img_array, cv2.IMREAD_UNCHANGED)
+            img = cv2.imdecode(img_array, cv2.IMREAD_GRAYSCALE)
 
         if img is None:
             abort(f"Unable to open file for reading.\ninput file: {filename}")
@@ -622,16 +773,36 @@ def convert_img_to_otp_urls(filename: str, args: Args) -> OtpUrls:
     return otp_urls
 
 
+@functools.lru_cache(maxsize=None)
+def get_qreader() -> Any:
+    '''Returns a shared QReader instance, since loading its detection model is slow.'''
+    from qreader import QReader  # type: ignore # imported on demand, since the import is slow
+    return QReader()
+
+
+@functools.lru_cache(maxsize=None)
+def get_cv2_qr_detector() -> cv2.QRCodeDetector:
+    '''Returns a shared OpenCV QR code detector.'''
+    return cv2.QRCodeDetector()
+
+
+@functools.lru_cache(maxsize=None)
+def get_cv2_wechat_qr_detector() -> cv2.wechat_qrcode.WeChatQRCode:
+    '''Returns a shared WeChat QR code detector, since loading its models is slow.'''
+    return cv2.wechat_qrcode.WeChatQRCode()
+
+
 def decode_qr_img_otp_urls(img: Any, qr_mode: QRMode) -> OtpUrls:
     otp_urls: OtpUrls = []
     if qr_mode in [QRMode.QREADER, QRMode.QREADER_DEEP]:
-        otp_url = QReader().detect_and_decode(img, qr_mode == QRMode.QREADER_DEEP)
+        # QReader expects a color image
+        otp_url = get_qreader().detect_and_decode(cv2.cvtColor(img, cv2.COLOR_GRAY2BGR) if img.ndim == 2 else img, qr_mode == QRMode.QREADER_DEEP)
         otp_urls.append(otp_url)
     elif qr_mode == QRMode.CV2:
-        otp_url, _, _ = cv2.QRCodeDetector().detectAndDecode(img)
+        otp_url, _, _ = get_cv2_qr_detector().detectAndDecode(img)
         otp_urls.append(otp_url)
     elif qr_mode == QRMode.CV2_WECHAT:
-        otp_url, _ = cv2.wechat_qrcode.WeChatQRCode().detectAndDecode(img)
+        otp_url, _ = get_cv2_wechat_qr_detector().detectAndDecode(img)
         otp_urls += list(otp_url)
     elif qr_mode == QRMode.ZBAR:
         qrcodes = zbar.decode(img, symbols=[zbar.ZBarSymbol.QRCODE])
@@ -656,22 +827,45 @@ def is_opt_url(otp_url: str, source: str) -> bool:
 # https://stackoverflow.com/questions/40226049/find-enums-listed-in-python-descriptor-for-protobuf
 def get_enum_name_by_number(parent: Any, field_name: str) -> str:
     field_value = getattr(parent, field_name)
-    return parent.DESCRIPTOR.fields_by_name[field_name].enum_type.values_by_number.get(field_value).name  # type: ignore # generic code
+    return get_enum_values_by_number(parent.DESCRIPTOR, field_name)[field_value].name  # type: ignore # generic code
+
+
+@functools.lru_cache(maxsize=None)
+def get_enum_values_by_number(descriptor: Any, field_name: str) -> Any:
+    '''The enum values depend only on the message type, thus cache them.'''
+    return descriptor.fields_by_name[field_name].enum_type.values_by_number
+
+
+def has_native_protobuf() -> bool:
+    '''upb (protobuf >= 4.21) and cpp are native backends, python is the slow pure Python fallback.'''
+    return api_implementation.Type() in ('upb', 'cpp')
 
 
 def get_otp_type_str_from_code(otp_type: int) -> str:
     return 'totp' if otp_type == 2 else 'hotp'
 
 
+def decode_base64(data_base64: str) -> bytes:
+    '''Decodes strictly, i.e. raises binascii.Error for non-alphabet characters.'''
+    if pybase64_available:
+        # SIMD accelerated decoder
+        return pybase64.b64decode(data_base64, validate=True)  # type: ignore
+    # workaround for PYTHON <= 3.10: strict_mode exists since Python 3.11
+    if sys.version_info >= (3, 11):
+        return binascii.a2b_base64(data_base64, strict_mode=True)
+    return base64.b64decode(data_base64, validate=True)
+
+
 def convert_secret_from_bytes_to_base32_str(bytes: bytes) -> str:
-    return str(base64.b32encode(bytes), 'utf-8').replace('=', '')
+    # padding is only at the end
+    return base64.b32encode(bytes).rstrip(b'=').decode('ascii')
 
 
-def build_otp_url(secret: str, raw_otp: pb.MigrationPayload.OtpParameters) -> str:
-    url_params = {'secret': secret}
-    if raw_otp.type == 1: url_params['counter'] = str(raw_otp.counter)
-    if raw_otp.issuer: url_params['issuer'] = raw_otp.issuer
-    otp_url = f"otpauth://{get_otp_type_str_from_code(raw_otp.type)}/{urlparse.quote(raw_otp.name)}?" + urlparse.urlencode(url_params)
+def build_otp_url(otp_type: str, name: str, secret: str, issuer: str, counter: Optional[int]) -> str:
+    # the base32 secret and the counter need no quoting, the issuer is quoted like by urlencode
+    otp_url = f"otpauth://{otp_type}/{quote(name)}?secret={secret}"
+    if counter is not None: otp_url += f"&counter={counter}"
+    if issuer: otp_url += f"&issuer={quote_plus(issuer)}"
     return otp_url
 
 
@@ -692,25 +886,27 @@ def write_url(otp: Otp, out: Optional[TextIO] = None) -> None:
 
 def save_qr_image(otp: Otp, dir: str, j: int) -> str:
     if not (os.path.exists(dir)): os.makedirs(dir, exist_ok=True)
-    pattern = re.compile(r'[\W_]+')
-    file_otp_name = pattern.sub('', otp['name'])
-    file_otp_issuer = pattern.sub('', otp['issuer'])
+    file_otp_name = FILE_NAME_INVALID_CHARS.sub('', otp['name'])
+    file_otp_issuer = FILE_NAME_INVALID_CHARS.sub('', otp['issuer'])
     save_qr_image_file(otp['url'], f"{dir}/{j}-{file_otp_name}{'-' + file_otp_issuer if file_otp_issuer else ''}.png")
     return file_otp_name
 
 
 def save_qr_image_file(otp_url: OtpUrl, name: str) -> None:
-    qr = QRCode()
-    qr.add_data(otp_url)
-    img = qr.make_image(fill_color='black', back_color='white')
+    img = create_qr_code(otp_url).make_image(fill_color='black', back_color='white')
     if verbose: print(f"Saving to {name}")
     img.save(name)
 
 
 def print_qr(otp_url: str, out: Optional[TextIO] = None) -> None:
+    create_qr_code(otp_url).print_ascii(out)
+
+
+def create_qr_code(otp_url: str) -> Any:
+    from qrcode import QRCode  # imported on demand, since the import is slow
     qr = QRCode()
     qr.add_data(otp_url)
-    qr.print_ascii(out)
+    return qr
 
 
 def write_txt(file: str, otps: Otps, write_qr: bool = False) -> None:
@@ -728,83 +924,73 @@ def write_urls(file: str, otps: Otps) -> None:
         with open_file_or_stdout(file) as outfile:
             for otp in otps:
                 write_url(otp, outfile)
-        if not quiet: print(f"Exported {len(otps)} otp{'s'[:len(otps) != 1]} to otpauth url list file {file}")
+        if not quiet: print(f"Exported {len(otps)} otp{plural_s(len(otps))} to otpauth url list file {file}")
 
 
 def write_csv(file: str, otps: Otps) -> None:
     if file and len(file) > 0 and len(otps) > 0:
         with open_file_or_stdout_for_csv(file) as outfile:
-            writer = csv.DictWriter(outfile, otps[0].keys())
-            writer.writeheader()
-            writer.writerows(otps)
-        if not quiet: print(f"Exported {len(otps)} otp{'s'[:len(otps) != 1]} to csv {file}")
+            writer = csv.writer(outfile)
+            writer.writerow(otps[0].keys())
+            # rows as value sequences, the values are in the order of the keys
+            writer.writerows(otp.values() for otp in otps)
+        if not quiet: print(f"Exported {len(otps)} otp{plural_s(len(otps))} to csv {file}")
 
 
 def write_keepass_csv(file: str, otps: Otps) -> None:
     if file and len(file) > 0 and len(otps) > 0:
-        has_totp = has_otp_type(otps, 'totp')
-        has_hotp = has_otp_type(otps, 'hotp')
+        totps: Otps = []
+        hotps: Otps = []
+        for otp in otps:
+            (totps if otp['type'] == 'totp' else hotps).append(otp)
+        has_totp = len(totps) > 0
+        has_hotp = len(hotps) > 0
         if file != '-':
             otp_filename_totp = file if has_totp != has_hotp else add_pre_suffix(file, "totp")
             otp_filename_hotp = file if has_totp != has_hotp else add_pre_suffix(file, "hotp")
         else:
             otp_filename_totp = otp_filename_hotp = '-'
         if has_totp:
-            count_totp_entries = write_keepass_totp_csv(otp_filename_totp, otps)
+            count_totp_entries = write_keepass_totp_csv(otp_filename_totp, totps)
         if has_hotp:
-            count_hotp_entries = write_keepass_htop_csv(otp_filename_hotp, otps)
+            count_hotp_entries = write_keepass_htop_csv(otp_filename_hotp, hotps)
         if not quiet:
-            if has_totp and count_totp_entries: print(f"Exported {count_totp_entries} totp entrie{'s'[:count_totp_entries != 1]} to keepass csv file {otp_filename_totp}")
-            if has_hotp and count_hotp_entries: print(f"Exported {count_hotp_entries} hotp entrie{'s'[:count_hotp_entries != 1]} to keepass csv file {otp_filename_hotp}")
+            if has_totp and count_totp_entries: print(f"Exported {count_totp_entries} totp entrie{plural_s(count_totp_entries)} to keepass csv file {otp_filename_totp}")
+            if has_hotp and count_hotp_entries: print(f"Exported {count_hotp_entries} hotp entrie{plural_s(count_hotp_entries)} to keepass csv file {otp_filename_hotp}")
 
 
 def write_keepass_totp_csv(file: str, otps: Otps) -> int:
-    count_entries = 0
     with open_file_or_stdout_for_csv(file) as outfile:
-        writer = csv.DictWriter(outfile, ["Title", "User Name", "TimeOtp-Secret-Base32", "Group"])
-        writer.writeheader()
-        for otp in otps:
-            if otp['type'] == 'totp':
-                writer.writerow({
-                    'Title': otp['issuer'],
-                    'User Name': otp['name'],
-                    'TimeOtp-Secret-Base32': otp['secret'] if otp['type'] == 'totp' else None,
-                    'Group': f"OTP/{otp['type'].upper()}"
-                })
-                count_entries += 1
-    return count_entries
+        writer = csv.writer(outfile)
+        writer.writerow(KEEPASS_TOTP_HEADER)
+        writer.writerows((otp['issuer'], otp['name'], otp['secret'], 'OTP/TOTP') for otp in otps)
+    return len(otps)
 
 
 def write_keepass_htop_csv(file: str, otps: Otps) -> int:
-    count_entries = 0
     with open_file_or_stdout_for_csv(file) as outfile:
-        writer = csv.DictWriter(outfile, ["Title", "User Name", "HmacOtp-Secret-Base32", "HmacOtp-Counter", "Group"])
-        writer.writeheader()
-        for otp in otps:
-            if otp['type'] == 'hotp':
-                writer.writerow({
-                    'Title': otp['issuer'],
-                    'User Name': otp['name'],
-                    'HmacOtp-Secret-Base32': otp['secret'] if otp['type'] == 'hotp' else None,
-                    'HmacOtp-Counter': otp['counter'] if otp['type'] == 'hotp' else None,
-                    'Group': f"OTP/{otp['type'].upper()}"
-                })
-                count_entries += 1
-    return count_entries
+        writer = csv.writer(outfile)
+        writer.writerow(KEEPASS_HOTP_HEADER)
+        writer.writerows((otp['issuer'], otp['name'], otp['secret'], otp['counter'], 'OTP/HOTP') for otp in otps)
+    return len(otps)
 
 
 def write_json(file: str, otps: Otps) -> None:
     if file and len(file) > 0:
         with open_file_or_stdout(file) as outfile:
-            json.dump(otps, outfile, indent=4)
-        if not quiet: print(f"Exported {len(otps)} otp{'s'[:len(otps) != 1]} to json {file}")
+            if orjson_available:
+                # orjson supports only an indentation of 2 spaces
+                outfile.write(orjson.dumps(otps, option=orjson.OPT_INDENT_2).decode('utf-8'))
+            else:
+                # json.dumps is faster than json.dump, which issues many small writes
+                # ensure_ascii=False writes utf-8 like orjson and skips the escaping of non-ascii characters
+                outfile.write(json.dumps(otps, indent=4, ensure_ascii=False))
+        if not quiet: print(f"Exported {len(otps)} otp{plural_s(len(otps))} to json {file}")
 
 
-def has_otp_type(otps: Otps, otp_type: str) -> bool:
-    for otp in otps:
-        if otp['type'] == otp_type:
-            return True
-    return False
+def plural_s(count: int) -> str:
+    '''Returns the plural suffix "s" for English nouns.'''
+    return '' if count == 1 else 's'
 
 
 def add_pre_suffix(file: str, pre_suffix: str) -> str:
@@ -813,19 +999,15 @@ def add_pre_suffix(file: str, pre_suffix: str) -> str:
     return name + "." + pre_suffix + (ext if ext else "")
 
 
-def open_file_or_stdout(filename: str) -> TextIO:
-    '''stdout is denoted as "-".
-    Note: Set before the following line:
-    sys.stdout.close = lambda: None'''
-    return open(filename, "w", encoding='utf-8') if filename != '-' else sys.stdout
+def open_file_or_stdout(filename: str) -> ContextManager[TextIO]:
+    '''stdout is denoted as "-", it is not closed at the end of the with block.'''
+    return open(filename, "w", encoding='utf-8', buffering=FILE_BUFFER_SIZE) if filename != '-' else contextlib.nullcontext(sys.stdout)
 
 
-def open_file_or_stdout_for_csv(filename: str) -> TextIO:
-    '''stdout is denoted as "-".
-    newline=''
-    Note: Set before the following line:
-    sys.stdout.close = lambda: None'''
-    return open(filename, "w", encoding='utf-8', newline='') if filename != '-' else sys.stdout
+def open_file_or_stdout_for_csv(filename: str) -> ContextManager[TextIO]:
+    '''stdout is denoted as "-", it is not closed at the end of the with block.
+    The file is opened with newline=''.'''
+    return open(filename, "w", encoding='utf-8', newline='', buffering=FILE_BUFFER_SIZE) if filename != '-' else contextlib.nullcontext(sys.stdout)
 
 
 def check_file_exists(filename: str) -> None:
@@ -841,12 +1023,20 @@ def has_no_otps_show_warning(otps: Otps) -> bool:
     return len(otps) == 0
 
 
-def is_binary(line: str) -> bool:
+def is_utf8(block: bytes) -> bool:
+    '''Image files contain non utf-8 bytes right at the beginning.'''
     try:
-        line.startswith('#')
-        return False
-    except (UnicodeDecodeError, AttributeError, TypeError):
+        # the incremental decoder accepts a multi-byte character which is cut at the end of the block
+        codecs.getincrementaldecoder('utf-8')().decode(block)
         return True
+    except UnicodeDecodeError:
+        return False
+
+
+def is_binary(line: str) -> bool:
+    '''A binary stream yields bytes instead of str, e.g. if sys.stdin is replaced by a binary stream.
+    A binary stream yields bytes from the first line on, thus only the first line is checked.'''
+    return not isinstance(line, str)
 
 
 def next_valid_qr_mode(qr_mode: QRMode, with_zbar: bool = True) -> QRMode:
@@ -871,6 +1061,9 @@ def do_debug_checks() -> bool:
     import pyzbar.pyzbar as zbar  # noqa: F401 # This is only a debug import
     log_debug('Try: from qreader import QReader')
     from qreader import QReader  # noqa: F401 # This is only a debug import
+    log_debug(f"Protobuf implementation: {api_implementation.Type()}")
+    if not has_native_protobuf():
+        log_warn("The pure Python protobuf implementation is used, decoding is slow.")
     print(color('\nDebug checks passed', colorama.Fore.GREEN))
     return True
 
@@ -924,13 +1117,13 @@ def get_raw_version() -> str:
 def log_debug(*values: object, sep: Optional[str] = ' ') -> None:
     if os.name == 'nt':
         # Workaround "Windows fatal exception: access violation"
-        print(f"\nDEBUG: {str(values[0])}")
+        print(f"\nDEBUG: {values[0]}")
         return
 
     if colored:
-        print(f"{colorama.Fore.CYAN}\nDEBUG: {str(values[0])}", *values[1:], colorama.Fore.RESET, sep=sep)
+        print(f"{colorama.Fore.CYAN}\nDEBUG: {values[0]}", *values[1:], colorama.Fore.RESET, sep=sep)
     else:
-        print(f"\nDEBUG: {str(values[0])}", *values[1:], sep=sep)
+        print(f"\nDEBUG: {values[0]}", *values[1:], sep=sep)
 
 
 # workaround for PYTHON <= 3.9 use: BaseException | None
@@ -940,18 +1133,23 @@ def log_verbose(msg: str) -> None:
 
 # workaround for PYTHON <= 3.9 use: BaseException | None
 def log_warn(msg: str, exception: Optional[BaseException] = None) -> None:
-    exception_text = "\nException: "
-    eprint(color(f"\nWARN: {msg}{(exception_text + str(exception)) if exception else ''}", colorama.Fore.RED))
+    log_stderr('WARN', msg, exception)
 
 
 # workaround for PYTHON <= 3.9 use: BaseException | None
 def log_error(msg: str, exception: Optional[BaseException] = None) -> None:
-    exception_text = "\nException: "
-    eprint(color(f"\nERROR: {msg}{(exception_text + str(exception)) if exception else ''}", colorama.Fore.RED))
+    log_stderr('ERROR', msg, exception)
+
+
+# workaround for PYTHON <= 3.9 use: BaseException | None
+def log_stderr(level: str, msg: str, exception: Optional[BaseException] = None) -> None:
+    eprint(color(f"\n{level}: {msg}" if exception is None else f"\n{level}: {msg}\nException: {exception}", colorama.Fore.RED))
 
 
 def color(msg: str, color: Optional[str] = None) -> str:
-    return f"{color if colored and color else ''}{msg}{colorama.Fore.RESET if colored and color else ''}"
+    if not (colored and color):
+        return msg
+    return f"{color}{msg}{colorama.Fore.RESET}"
 
 
 def eprint(*values: object, **kwargs: Any) -> None:
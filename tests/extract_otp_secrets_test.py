@@ -20,11 +20,14 @@
 
 from __future__ import annotations  # workaround for PYTHON <= 3.10
 
+import binascii
 import io
 import os
 import pathlib
+import queue
 import re
 import sys
+import threading
 import time
 from enum import Enum
 from typing import Any, List, Optional, Tuple
@@ -40,6 +43,7 @@ import extract_otp_secrets
 
 try:
     import cv2
+    import numpy as np
     from extract_otp_secrets import SUCCESS_COLOR, FAILURE_COLOR, FONT, FONT_SCALE, FONT_COLOR, FONT_THICKNESS, FONT_LINE_STYLE
 except ImportError:
     # ignore
@@ -210,6 +214,39 @@ def test_extract_csv(capsys: pytest.CaptureFixture[str], tmp_path: pathlib.Path)
     assert captured.err == ''
 
 
+def test_extract_csv_same_file_twice(capsys: pytest.CaptureFixture[str], tmp_path: pathlib.Path) -> None:
+    # Arrange
+    output_file = str(tmp_path / 'test_example_output.csv')
+
+    # Act
+    extract_otp_secrets.main(['-q', '-c', output_file, 'example_export.txt', 'example_export.txt'])
+
+    # Assert
+    expected_csv = read_csv('example_output.csv')
+    actual_csv = read_csv(output_file)
+
+    assert actual_csv == expected_csv + expected_csv[1:]
+
+    captured = capsys.readouterr()
+
+    assert captured.out == ''
+    assert captured.err == ''
+
+
+def test_extract_same_file_twice_debug_output(capsys: pytest.CaptureFixture[str]) -> None:
+    # Act
+    extract_otp_secrets.main(['-n', '-vvv', 'example_export.txt'])
+    single_captured = capsys.readouterr()
+    extract_otp_secrets.main(['-n', '-vvv', 'example_export.txt', 'example_export.txt'])
+
+    # Assert
+    captured = capsys.readouterr()
+
+    assert single_captured.out.count('Payload Line') == 5
+    assert captured.out.count('Payload Line') == 10
+    assert captured.out.count('data_base64=') == 10
+
+
 def test_extract_csv_stdout(capsys: pytest.CaptureFixture[str]) -> None:
     # Act
     extract_otp_secrets.main(['-c', '-', 'example_export.txt'])
@@ -514,6 +551,23 @@ def test_extract_saveqr(capsys: pytest.CaptureFixture[str], tmp_path: pathlib.Pa
     assert count_files_in_dir(tmp_path) == 6
 
 
+@pytest.mark.parametrize("ignore,expected_otp_keys_count", [(False, 0), (True, 1)])
+def test_extract_otp_keys_only_for_ignore(ignore: bool, expected_otp_keys_count: int, capsys: pytest.CaptureFixture[str]) -> None:
+    # Arrange
+    args = extract_otp_secrets.parse_args(['-q', '-i', 'example_export.txt'] if ignore else ['-q', 'example_export.txt'])
+    otp_url = 'otpauth-migration://offline?data=CjUKEPqlBekzoNEukL7qlsjBCDYSDnBpQHJhc3BiZXJyeXBpGgtyYXNwYmVycnlwaSABKAEwAhABGAEgACjr4JKK%2B%2F%2F%2F%2F%2F8B'
+    otps: extract_otp_secrets.Otps = []
+    otp_keys: set[Tuple[Any, ...]] = set()
+
+    # Act
+    extract_otp_secrets.extract_otp_from_otp_url(otp_url, otps, otp_keys, {}, 1, 'test', args)
+    extract_otp_secrets.extract_otp_from_otp_url(otp_url, otps, otp_keys, {}, 2, 'test', args)
+
+    # Assert
+    assert len(otp_keys) == expected_otp_keys_count
+    assert len(otps) == 2 - expected_otp_keys_count
+
+
 def test_extract_ignored_duplicates(capsys: pytest.CaptureFixture[str]) -> None:
     # Act
     extract_otp_secrets.main(['-i', 'example_export.txt'])
@@ -776,6 +830,170 @@ def test_extract_otps_from_camera(qr_reader: Optional[str], file: str, success:
         assert e.type == SystemExit
 
 
+@pytest.mark.skipif(not cv2_available, reason="cv2 is not installed")
+def test_extract_otps_from_camera_text_width_cache(mocker: MockerFixture) -> None:
+    # Arrange
+    # the width of the real font is cached before the camera session
+    extract_otp_secrets.cv2_get_text_width("0 otps extracted")
+    mocker.patch('cv2.VideoCapture', return_value=MockCam(['tests/data/lena_std.tif']))
+    mocker.patch('cv2.namedWindow')
+    mocker.patch('cv2.imshow')
+    mocker.patch('cv2.getTextSize', return_value=([8, 200], False))
+    mocked_putText = mocker.patch('cv2.putText')
+    mocker.patch('cv2.getWindowImageRect', return_value=[0, 0, 640, 480])
+    mocker.patch('cv2.waitKey', return_value=27)
+    mocker.patch('cv2.getWindowProperty', return_value=False)
+    mocker.patch('cv2.destroyAllWindows')
+
+    # Act
+    extract_otp_secrets.main(['-Q', 'CV2'])
+
+    # Assert
+    # the camera session uses the width of the patched getTextSize
+    mocked_putText.assert_called_with(mocker.ANY, "0 otps extracted", (640 - 8 - extract_otp_secrets.BORDER, mocker.ANY), FONT, FONT_SCALE, FONT_COLOR, FONT_THICKNESS, FONT_LINE_STYLE)
+
+
+@pytest.mark.skipif(not cv2_available, reason="cv2 is not installed")
+def test_qreader_detect_and_decode_odd_frame_size(mocker: MockerFixture) -> None:
+    # Arrange
+    mocked_qreader = mocker.Mock()
+    mocked_qreader.detect.return_value = (True, (10, 20, 160, 120))
+    mocked_qreader.decode.return_value = 'otpauth-migration://offline?data=XXXX'
+    mocker.patch('extract_otp_secrets.get_qreader', return_value=mocked_qreader)
+    img = np.zeros((241, 321, 3), np.uint8)
+
+    # Act
+    otp_url, bbox = extract_otp_secrets.qreader_detect_and_decode(img, False)
+
+    # Assert
+    small_img = mocked_qreader.detect.call_args[0][0]
+    assert small_img.shape == (120, 160, 3)
+    # the bounding box is scaled back by the actual size ratios and stays within the frame
+    assert bbox == (int(10 * 321 / 160), int(20 * 241 / 120), 321, 241)
+    mocked_qreader.decode.assert_called_once_with(img, bbox)
+    mocked_qreader.detect_and_decode.assert_not_called()
+    assert otp_url == 'otpauth-migration://offline?data=XXXX'
+
+
+@pytest.mark.skipif(not cv2_available, reason="cv2 is not installed")
+def test_qreader_detect_and_decode_not_found(mocker: MockerFixture) -> None:
+    # Arrange
+    mocked_qreader = mocker.Mock()
+    mocked_qreader.detect.return_value = (False, None)
+    mocker.patch('extract_otp_secrets.get_qreader', return_value=mocked_qreader)
+
+    # Act
+    otp_url, bbox = extract_otp_secrets.qreader_detect_and_decode(np.zeros((480, 640, 3), np.uint8), False)
+
+    # Assert
+    assert (otp_url, bbox) == (None, None)
+    mocked_qreader.decode.assert_not_called()
+
+
+@pytest.mark.skipif(not cv2_available, reason="cv2 is not installed")
+def test_qreader_detect_and_decode_deep_search(mocker: MockerFixture) -> None:
+    # Arrange
+    mocked_qreader = mocker.Mock()
+    mocked_qreader.detect.return_value = (True, (10, 20, 160, 120))
+    mocked_qreader.detect_and_decode.return_value = 'otpauth-migration://offline?data=XXXX'
+    mocker.patch('extract_otp_secrets.get_qreader', return_value=mocked_qreader)
+    img = np.zeros((480, 640, 3), np.uint8)
+
+    # Act
+    otp_url, bbox = extract_otp_secrets.qreader_detect_and_decode(img, True)
+
+    # Assert
+    # the bounding box for the drawing is detected on the downscaled frame only
+    assert mocked_qreader.detect.call_count == 1
+    assert mocked_qreader.detect.call_args[0][0].shape == (240, 320, 3)
+    mocked_qreader.detect_and_decode.assert_called_once_with(img, True)
+    mocked_qreader.decode.assert_not_called()
+    assert otp_url == 'otpauth-migration://offline?data=XXXX'
+    assert bbox == (20, 40, 320, 240)
+
+
+@pytest.mark.skipif(not cv2_available, reason="cv2 is not installed")
+def test_is_frame_changed() -> None:
+    # Arrange
+    frame = np.full(extract_otp_secrets.FRAME_DIFF_SIZE, 100, np.uint8)
+
+    # Act & Assert
+    assert extract_otp_secrets.is_frame_changed(frame, None)
+    assert not extract_otp_secrets.is_frame_changed(frame, frame.copy())
+    # the sum of the pixel differences is below the threshold
+    assert not extract_otp_secrets.is_frame_changed(frame, frame + 1)
+    assert extract_otp_secrets.is_frame_changed(frame, frame + 2)
+    assert extract_otp_secrets.is_frame_changed(frame, frame - 2)
+
+
+@pytest.mark.skipif(not cv2_available, reason="cv2 is not installed")
+def test_is_detection_needed() -> None:
+    # Arrange
+    frame = np.full(extract_otp_secrets.FRAME_DIFF_SIZE, 100, np.uint8)
+    max_age = extract_otp_secrets.FRAME_DIFF_MAX_AGE
+
+    # Act & Assert
+    assert extract_otp_secrets.is_detection_needed(frame, None, 0.0)
+    assert not extract_otp_secrets.is_detection_needed(frame, frame.copy(), 0.0)
+    assert not extract_otp_secrets.is_detection_needed(frame, frame.copy(), max_age / 2)
+    # an unchanged frame is detected again after the max age
+    assert extract_otp_secrets.is_detection_needed(frame, frame.copy(), max_age)
+    assert extract_otp_secrets.is_detection_needed(frame, frame + 2, 0.0)
+
+
+@pytest.mark.skipif(not cv2_available, reason="cv2 is not installed")
+def test_cv2_capture_frames_keeps_newest_frame(capsys: pytest.CaptureFixture[str]) -> None:
+    # Arrange
+    mockCam: Any = MockCam(['example_export.png', 'tests/data/lena_std.tif', ''], MockMode.LOOP_LIST)
+    frames: queue.Queue[Tuple[bool, Any]] = queue.Queue(maxsize=1)
+
+    # Act
+    extract_otp_secrets.cv2_capture_frames(mockCam, frames, threading.Event())
+
+    # Assert
+    captured = capsys.readouterr()
+
+    # the capturing stops after the failed read, which is the newest frame
+    assert mockCam.read_counter == 3
+    assert frames.get_nowait() == (False, None)
+    assert frames.empty()
+    assert captured.err == ''
+
+
+@pytest.mark.skipif(not cv2_available, reason="cv2 is not installed")
+def test_cv2_capture_frames_stop_event(mocker: MockerFixture) -> None:
+    # Arrange
+    mockCam = mocker.Mock()
+    frames: queue.Queue[Tuple[bool, Any]] = queue.Queue(maxsize=1)
+    stop_capture = threading.Event()
+    stop_capture.set()
+
+    # Act
+    extract_otp_secrets.cv2_capture_frames(mockCam, frames, stop_capture)
+
+    # Assert
+    mockCam.read.assert_not_called()
+    assert frames.empty()
+
+
+@pytest.mark.skipif(not cv2_available, reason="cv2 is not installed")
+def test_cv2_capture_frames_read_error(capsys: pytest.CaptureFixture[str], mocker: MockerFixture, monkeypatch: pytest.MonkeyPatch) -> None:
+    # Arrange
+    monkeypatch.setattr(extract_otp_secrets, 'colored', False)
+    mockCam = mocker.Mock()
+    mockCam.read.side_effect = OSError('camera disconnected')
+    frames: queue.Queue[Tuple[bool, Any]] = queue.Queue(maxsize=1)
+
+    # Act
+    extract_otp_secrets.cv2_capture_frames(mockCam, frames, threading.Event())
+
+    # Assert
+    captured = capsys.readouterr()
+
+    assert frames.get_nowait() == (False, None)
+    assert captured.err == '\nERROR: Could not read frame from camera\nException: camera disconnected\n'
+
+
 def test_verbose_and_quiet(capsys: pytest.CaptureFixture[str]) -> None:
     with pytest.raises(SystemExit) as e:
         # Act
@@ -873,6 +1091,47 @@ def test_wrong_content(capsys: pytest.CaptureFixture[str]) -> None:
     assert captured.err == EXPECTED_STDERR_OTP_URL_WRONG
 
 
+def test_text_followed_by_binary_content(capsys: pytest.CaptureFixture[str], tmp_path: pathlib.Path) -> None:
+    # Arrange
+    mixed_file = tmp_path / 'mixed.txt'
+    mixed_file.write_bytes(read_file_to_str('example_export.txt').encode('utf-8') + b'\x89PNG\xff')
+
+    # Act
+    with pytest.raises(SystemExit) as e:
+        extract_otp_secrets.main(['-n', str(mixed_file)])
+
+    # Assert
+    captured = capsys.readouterr()
+
+    # the file is read as image, thus no otp of the text part is extracted
+    assert captured.out == ''
+    assert captured.err == f"\nERROR: Unable to open file for reading.\ninput file: {mixed_file}\n"
+    assert e.value.code == 1
+
+
+def test_text_with_binary_content_after_first_block(capsys: pytest.CaptureFixture[str], tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # Arrange
+    monkeypatch.setattr(extract_otp_secrets, 'FILE_BUFFER_SIZE', 1024)
+    mixed_file = tmp_path / 'mixed.txt'
+    otp_url = 'otpauth-migration://offline?data=CjUKEPqlBekzoNEukL7qlsjBCDYSDnBpQHJhc3BiZXJyeXBpGgtyYXNwYmVycnlwaSABKAEwAhABGAEgACjr4JKK%2B%2F%2F%2F%2F%2F8B\n'
+    # larger than the buffer and the chunks of the text decoder, thus lines are extracted before the non utf-8 content is read
+    mixed_file.write_bytes(otp_url.encode('utf-8') * 1000 + b'\x89PNG\xff')
+    output_file = tmp_path / 'output.csv'
+
+    # Act
+    with pytest.raises(SystemExit) as e:
+        extract_otp_secrets.main(['-n', '-q', '--csv', str(output_file), str(mixed_file)])
+
+    # Assert
+    captured = capsys.readouterr()
+
+    assert captured.out == ''
+    assert captured.err.startswith(f"\nERROR: Unable to read text file {mixed_file}, it is not utf-8 encoded\nException: 'utf-8' codec can't decode byte 0x89")
+    assert e.value.code == 1
+    # no partial export
+    assert not output_file.exists()
+
+
 def test_one_wrong_file(capsys: pytest.CaptureFixture[str]) -> None:
     # Act
     extract_otp_secrets.main(['-n', 'tests/data/test_export_wrong_content.txt', 'example_export.txt'])
@@ -952,6 +1211,18 @@ def test_add_pre_suffix(capsys: pytest.CaptureFixture[str]) -> None:
     assert extract_otp_secrets.add_pre_suffix("name", "totp") == "name.totp"
 
 
+def test_build_otp_url() -> None:
+    assert extract_otp_secrets.build_otp_url('hotp', 'a b@c', 'ABC', 'Iss uer&+', 4) == 'otpauth://hotp/a%20b%40c?secret=ABC&counter=4&issuer=Iss+uer%26%2B'
+    assert extract_otp_secrets.build_otp_url('hotp', 'name', 'ABC', '', 0) == 'otpauth://hotp/name?secret=ABC&counter=0'
+    assert extract_otp_secrets.build_otp_url('totp', 'name', 'ABC', '', None) == 'otpauth://totp/name?secret=ABC'
+
+
+def test_decode_base64() -> None:
+    assert extract_otp_secrets.decode_base64("SGVsbG8+") == b"Hello>"
+    with pytest.raises(binascii.Error):
+        extract_otp_secrets.decode_base64("SGVs bG8+")
+
+
 @pytest.mark.qreader
 def test_img_qr_reader_from_file_happy_path(capsys: pytest.CaptureFixture[str]) -> None:
     # Act